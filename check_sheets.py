@@ -6,7 +6,7 @@ Quick script to check available sheets in the Google Sheets document
 import os
 from dotenv import load_dotenv
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from google_sheets import build_sheets_service
 
 load_dotenv()
 
@@ -18,7 +18,7 @@ def check_sheets():
         
         scopes = ['https://www.googleapis.com/auth/spreadsheets']
         credentials = Credentials.from_service_account_file(credentials_path, scopes=scopes)
-        service = build('sheets', 'v4', credentials=credentials)
+        service = build_sheets_service(credentials)
         
         # Get spreadsheet metadata
         spreadsheet = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
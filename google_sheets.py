@@ -1,6 +1,8 @@
 import os
+import functools
 import logging
-from typing import List, Dict, Optional
+from datetime import date, datetime
+from typing import Any, List, Dict, Iterator, Optional, Set, Tuple
 from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
@@ -8,12 +10,35 @@ from googleapiclient.errors import HttpError
 
 logger = logging.getLogger(__name__)
 
+# Suffix of the optional helper tab that filters pending rows server-side, e.g.
+# "outreach_leads_pending" with A1 set to:
+# =FILTER({ROW(outreach_leads!A2:A), outreach_leads!A2:E}, LOWER(outreach_leads!E2:E)="pending")
+PENDING_SHEET_SUFFIX = "_pending"
+
+# Fields of a lead, in column order after the row number
+LEAD_FIELDS = ('row_number', 'name', 'contact', 'interest', 'region', 'status')
+
+def build_sheets_service(credentials):
+    """Build a Sheets v4 client from the discovery document bundled with the library.
+    
+    static_discovery avoids fetching the discovery JSON over the network on every run.
+    """
+    return build('sheets', 'v4', credentials=credentials, static_discovery=True, cache_discovery=False)
+
 class GoogleSheetsManager:
     def __init__(self, credentials_path: str, spreadsheet_id: str):
         self.credentials_path = credentials_path
         self.spreadsheet_id = spreadsheet_id
-        self.service = None
-        self._authenticate()
+        # Leads already read, keyed by (sheet_name, range_name) and stored column-wise
+        # (one list per field) so status scans only touch the status column
+        self._columns: Dict[Tuple[str, str], Dict[str, List]] = {}
+        # Sheets found to have no pending helper tab, so it is only looked for once
+        self._missing_pending_sheets: Set[str] = set()
+    
+    @functools.cached_property
+    def service(self):
+        """Sheets API client, authenticated and built on first use."""
+        return self._authenticate()
     
     def _authenticate(self):
         """Authenticate with Google Sheets API using service account credentials."""
@@ -22,52 +47,87 @@ class GoogleSheetsManager:
             credentials = Credentials.from_service_account_file(
                 self.credentials_path, scopes=scopes
             )
-            self.service = build('sheets', 'v4', credentials=credentials)
+            service = build_sheets_service(credentials)
             logger.info("Successfully authenticated with Google Sheets API")
+            return service
         except Exception as e:
-            logger.error(f"Failed to authenticate with Google Sheets: {e}")
+            logger.error("Failed to authenticate with Google Sheets: %s", e)
             raise
     
-    def read_leads(self, sheet_name: str = "outreach_leads", range_name: str = "A:E") -> List[Dict]:
+    def iter_leads(self, sheet_name: str = "outreach_leads", range_name: str = "A:E",
+                   refresh: bool = False) -> Iterator[Dict]:
+        """Yield leads from Google Sheets one at a time.
+        
+        Results are cached per sheet; pass refresh=True to force a new read.
+        """
+        cache_key = (sheet_name, range_name)
+        if not refresh and cache_key in self._columns:
+            columns = self._columns[cache_key]
+            for index in range(len(columns['row_number'])):
+                yield self._lead_at(columns, index)
+            return
+        
+        columns = {field: [] for field in LEAD_FIELDS}
+        values = self._fetch_values(sheet_name, range_name)
+        if not values:
+            logger.warning("No data found in the sheet")
+            self._columns[cache_key] = columns
+            return
+        
+        # Assume first row contains headers; cells past the end of a short row read as ""
+        # when the headers cover that column, matching the old row padding
+        status_default = "" if len(values[0]) > 4 else "Pending"
+        
+        for i, row in enumerate(values[1:], start=2):  # Start from row 2
+            width = len(row)
+            lead = {
+                'row_number': i,
+                'name': row[0] if width > 0 else "",
+                'contact': row[1] if width > 1 else "",
+                'interest': row[2] if width > 2 else "",
+                'region': row[3] if width > 3 else "",
+                'status': row[4] if width > 4 else status_default
+            }
+            for field in LEAD_FIELDS:
+                columns[field].append(lead[field])
+            yield lead
+        
+        logger.info("Successfully read %s leads from sheet", len(columns['row_number']))
+        self._columns[cache_key] = columns
+    
+    def read_leads(self, sheet_name: str = "outreach_leads", range_name: str = "A:E",
+                   refresh: bool = False) -> List[Dict]:
         """Read leads from Google Sheets and return as list of dictionaries."""
+        return list(self.iter_leads(sheet_name, range_name, refresh))
+    
+    def _lead_at(self, columns: Dict[str, List], index: int) -> Dict:
+        """Build the lead dictionary for one row of the column cache."""
+        return {field: columns[field][index] for field in LEAD_FIELDS}
+    
+    def _get_columns(self, sheet_name: str, range_name: str = "A:E") -> Dict[str, List]:
+        """Return the cached columns for a sheet, reading it first if needed."""
+        cache_key = (sheet_name, range_name)
+        if cache_key not in self._columns:
+            for _ in self.iter_leads(sheet_name, range_name):
+                pass
+        return self._columns[cache_key]
+    
+    def _fetch_values(self, sheet_name: str, range_name: str) -> List[List]:
+        """Fetch the raw cell values for a range."""
         try:
             result = self.service.spreadsheets().values().get(
                 spreadsheetId=self.spreadsheet_id,
-                range=f"{sheet_name}!{range_name}"
+                range=f"{sheet_name}!{range_name}",
+                fields='values'
             ).execute()
             
-            values = result.get('values', [])
-            if not values:
-                logger.warning("No data found in the sheet")
-                return []
-            
-            # Assume first row contains headers
-            headers = values[0]
-            leads = []
-            
-            for i, row in enumerate(values[1:], start=2):  # Start from row 2
-                # Pad row with empty strings if it's shorter than headers
-                while len(row) < len(headers):
-                    row.append("")
-                
-                lead = {
-                    'row_number': i,
-                    'name': row[0] if len(row) > 0 else "",
-                    'contact': row[1] if len(row) > 1 else "",
-                    'interest': row[2] if len(row) > 2 else "",
-                    'region': row[3] if len(row) > 3 else "",
-                    'status': row[4] if len(row) > 4 else "Pending"
-                }
-                leads.append(lead)
-            
-            logger.info(f"Successfully read {len(leads)} leads from sheet")
-            return leads
+            return result.get('values', [])
             
         except HttpError as e:
-            logger.error(f"HTTP error reading from Google Sheets: {e}")
+            logger.error("HTTP error reading from Google Sheets: %s", e)
             raise
         except Exception as e:
-            logger.error(f"Error reading from Google Sheets: {e}")
+            logger.error("Error reading from Google Sheets: %s", e)
             raise
     
     def update_lead_status(self, row_number: int, status: str, sheet_name: str = "outreach_leads"):
@@ -87,19 +147,150 @@ class GoogleSheetsManager:
                 body=body
             ).execute()
             
-            logger.info(f"Updated row {row_number} status to '{status}'")
+            logger.info("Updated row %s status to '%s'", row_number, status)
+            self._apply_cached_statuses({row_number: status}, sheet_name)
             return result
             
         except HttpError as e:
-            logger.error(f"HTTP error updating Google Sheets: {e}")
+            logger.error("HTTP error updating Google Sheets: %s", e)
+            raise
+        except Exception as e:
+            logger.error("Error updating Google Sheets: %s", e)
+            raise
+    
+    def batch_update_statuses(self, updates: List[Tuple[int, Any]], sheet_name: str = "outreach_leads",
+                              value_input_option: Optional[str] = None):
+        """Update the status of several leads in a single batchUpdate request.
+        
+        Plain status strings are written RAW, skipping server-side parsing. Dates and
+        numbers default to USER_ENTERED so Sheets stores them as typed values.
+        """
+        if not updates:
+            return None
+        
+        if value_input_option is None:
+            typed = any(not isinstance(value, str) for _, value in updates)
+            value_input_option = 'USER_ENTERED' if typed else 'RAW'
+        
+        try:
+            # Column E (index 4) is the status column
+            data = [
+                {'range': f"{sheet_name}!E{row_number}", 'values': [[self._cell_value(value)]]}
+                for row_number, value in updates
+            ]
+            
+            body = {
+                'valueInputOption': value_input_option,
+                'data': data
+            }
+            
+            result = self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body=body
+            ).execute()
+            
+            logger.info("Updated status of %s rows in one batch", len(updates))
+            self._apply_cached_statuses(
+                {row_number: str(self._cell_value(value)) for row_number, value in updates}, sheet_name
+            )
+            return result
+        
+        except HttpError as e:
+            logger.error("HTTP error batch updating Google Sheets: %s", e)
             raise
         except Exception as e:
-            logger.error(f"Error updating Google Sheets: {e}")
+            logger.error("Error batch updating Google Sheets: %s", e)
             raise
     
+    def _cell_value(self, value: Any) -> Any:
+        """Convert a value to something the Sheets API accepts in a values body."""
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(value, date):
+            return value.strftime('%Y-%m-%d')
+        return value
+    
+    def invalidate(self, sheet_name: Optional[str] = None):
+        """Drop cached leads for a sheet, or for every sheet if none is given."""
+        if sheet_name is None:
+            self._columns.clear()
+            return
+        
+        for cache_key in [key for key in self._columns if key[0] == sheet_name]:
+            del self._columns[cache_key]
+    
+    def _apply_cached_statuses(self, statuses: Dict[int, str], sheet_name: str):
+        """Mirror written statuses into the cached leads so they stay current without a re-read."""
+        for (cached_sheet, _), columns in self._columns.items():
+            if cached_sheet != sheet_name:
+                continue
+            status_column = columns['status']
+            for index, row_number in enumerate(columns['row_number']):
+                if row_number in statuses:
+                    status_column[index] = statuses[row_number]
+    
+    def get_pending_rows(self, sheet_name: str = "outreach_leads") -> List[int]:
+        """Get the column-cache indices of leads with 'Pending' status."""
+        statuses = self._get_columns(sheet_name)['status']
+        return [index for index, status in enumerate(statuses) if status.lower() == 'pending']
+    
+    def iter_pending_or_error(self, sheet_name: str = "outreach_leads") -> Iterator[Dict]:
+        """Yield leads with 'Pending' or 'Error' status, served from the cache when loaded."""
+        columns = self._get_columns(sheet_name)
+        for index, status in enumerate(columns['status']):
+            if status.lower() in ('pending', 'error'):
+                yield self._lead_at(columns, index)
+    
     def get_pending_leads(self, sheet_name: str = "outreach_leads") -> List[Dict]:
         """Get only leads with 'Pending' status."""
-        all_leads = self.read_leads(sheet_name)
-        pending_leads = [lead for lead in all_leads if lead['status'].lower() == 'pending']
-        logger.info(f"Found {len(pending_leads)} pending leads")
+        columns = self._get_columns(sheet_name)
+        pending_leads = [self._lead_at(columns, index) for index in self.get_pending_rows(sheet_name)]
+        logger.info("Found %s pending leads", len(pending_leads))
+        return pending_leads
+    
+    def get_pending_leads_server(self, sheet_name: str = "outreach_leads") -> List[Dict]:
+        """Get pending leads from the server-side filtered helper tab.
+        
+        The helper tab holds the original row number followed by columns A:E, so only
+        pending rows are transferred. Falls back to get_pending_leads if the tab is
+        missing or empty; a missing tab is remembered so later calls skip the lookup.
+        """
+        if sheet_name in self._missing_pending_sheets:
+            return self.get_pending_leads(sheet_name)
+        
+        pending_sheet = f"{sheet_name}{PENDING_SHEET_SUFFIX}"
+        try:
+            result = self.service.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id,
+                range=f"{pending_sheet}!A:F",
+                fields='values'
+            ).execute()
+        except HttpError as e:
+            # A range naming a tab that doesn't exist is rejected with a 400
+            if e.resp.status != 400:
+                raise
+            logger.info("No '%s' tab; reading full sheet", pending_sheet)
+            self._missing_pending_sheets.add(sheet_name)
+            return self.get_pending_leads(sheet_name)
+        
+        values = result.get('values', [])
+        # FILTER yields #N/A when nothing matches, so only trust rows with a row number
+        rows = [row for row in values if row and str(row[0]).isdigit()]
+        if not rows:
+            logger.info("'%s' tab is empty; reading full sheet", pending_sheet)
+            return self.get_pending_leads(sheet_name)
+        
+        pending_leads = []
+        for row in rows:
+            lead = {
+                'row_number': int(row[0]),
+                'name': row[1] if len(row) > 1 else "",
+                'contact': row[2] if len(row) > 2 else "",
+                'interest': row[3] if len(row) > 3 else "",
+                'region': row[4] if len(row) > 4 else "",
+                'status': row[5] if len(row) > 5 else "Pending"
+            }
+            pending_leads.append(lead)
+        
+        logger.info("Found %s pending leads", len(pending_leads))
         return pending_leads
\ No newline at end of file
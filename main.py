@@ -6,13 +6,19 @@ Outreach Assistant - Automated lead outreach via email and WhatsApp
 import os
 import sys
 import logging
+import time
 import argparse
+import asyncio
+from dataclasses import dataclass
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from google_sheets import GoogleSheetsManager
 from message_generator import MessageGenerator
-from sender import MessageSender
+from sender import (
+    MessageSender, normalize_contact, SMTP_MESSAGES_PER_SECOND, TWILIO_MESSAGES_PER_SECOND
+)
+from rate_limiter import RateLimiter
 
 # Configure logging
 logging.basicConfig(
@@ -26,137 +32,347 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Silence the discovery cache warnings googleapiclient logs on every build
+logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
+
+# Number of messages generated at the same time
+GENERATE_WORKERS = 4
+
+# Number of messages sent at the same time
+MAX_CONCURRENT_LEADS = 8
+
+# Status updates are written to the sheet once this many are buffered...
+STATUS_BATCH_SIZE = 25
+
+# ...or after this many seconds, whichever comes first
+STATUS_FLUSH_SECONDS = 2
+
+# A failed status write is retried once after this many seconds
+STATUS_RETRY_SECONDS = 1
+
+# Required environment variables; each maps to the lowercased Env field
+REQUIRED_ENV_VARS = (
+    'GOOGLE_SHEETS_CREDENTIALS',
+    'SPREADSHEET_ID',
+    'GEMINI_API_KEY',
+    'GMAIL_USER',
+    'GMAIL_APP_PASSWORD',
+    'TWILIO_ACCOUNT_SID',
+    'TWILIO_AUTH_TOKEN',
+    'TWILIO_WHATSAPP_NUMBER'
+)
+
+@dataclass(frozen=True, slots=True)
+class Env:
+    """Configuration read from the environment once at startup."""
+    google_sheets_credentials: str
+    spreadsheet_id: str
+    gemini_api_key: str
+    gmail_user: str
+    gmail_app_password: str
+    twilio_account_sid: str
+    twilio_auth_token: str
+    twilio_whatsapp_number: str
+    twilio_messaging_service_sid: Optional[str] = None
+
 class OutreachAssistant:
     def __init__(self):
+        self.env = None
         self.sheets_manager = None
         self.message_generator = None
         self.sender = None
+        self._status_updates = []
+        self._status_sheet = None
+        # Status updates that could not be written, even after a retry
+        self._unwritten_statuses = []
         self._load_environment()
         self._initialize_components()
     
     def _load_environment(self):
-        """Load environment variables from .env file."""
+        """Load and validate environment variables from .env file once."""
         load_dotenv()
         
-        # Required environment variables
-        required_vars = [
-            'GOOGLE_SHEETS_CREDENTIALS',
-            'SPREADSHEET_ID',
-            'GEMINI_API_KEY',
-            'GMAIL_USER',
-            'GMAIL_APP_PASSWORD',
-            'TWILIO_ACCOUNT_SID',
-            'TWILIO_AUTH_TOKEN',
-            'TWILIO_WHATSAPP_NUMBER'
-        ]
-        
-        missing_vars = []
-        for var in required_vars:
-            if not os.getenv(var):
-                missing_vars.append(var)
+        values = {var: os.environ.get(var, '') for var in REQUIRED_ENV_VARS}
+        missing_vars = [var for var, value in values.items() if not value]
         
         if missing_vars:
-            logger.error(f"Missing required environment variables: {', '.join(missing_vars)}")
+            logger.error("Missing required environment variables: %s", ', '.join(missing_vars))
             logger.error("Please check your .env file and ensure all variables are set.")
             sys.exit(1)
         
+        self.env = Env(
+            **{var.lower(): value for var, value in values.items()},
+            twilio_messaging_service_sid=os.environ.get('TWILIO_MESSAGING_SERVICE_SID') or None
+        )
         logger.info("Environment variables loaded successfully")
     
     def _initialize_components(self):
-        """Initialize all components with environment variables."""
+        """Initialize all components from the loaded environment."""
+        env = self.env
         try:
             # Initialize Google Sheets manager
             self.sheets_manager = GoogleSheetsManager(
-                credentials_path=os.getenv('GOOGLE_SHEETS_CREDENTIALS'),
-                spreadsheet_id=os.getenv('SPREADSHEET_ID')
+                credentials_path=env.google_sheets_credentials,
+                spreadsheet_id=env.spreadsheet_id
             )
             
             # Initialize message generator
             self.message_generator = MessageGenerator(
-                api_key=os.getenv('GEMINI_API_KEY')
+                api_key=env.gemini_api_key
             )
             
             # Initialize message sender
             self.sender = MessageSender(
-                gmail_user=os.getenv('GMAIL_USER'),
-                gmail_password=os.getenv('GMAIL_APP_PASSWORD'),
-                twilio_sid=os.getenv('TWILIO_ACCOUNT_SID'),
-                twilio_token=os.getenv('TWILIO_AUTH_TOKEN'),
-                twilio_whatsapp_number=os.getenv('TWILIO_WHATSAPP_NUMBER')
+                gmail_user=env.gmail_user,
+                gmail_password=env.gmail_app_password,
+                twilio_sid=env.twilio_account_sid,
+                twilio_token=env.twilio_auth_token,
+                twilio_whatsapp_number=env.twilio_whatsapp_number,
+                twilio_messaging_service_sid=env.twilio_messaging_service_sid
             )
             
             logger.info("All components initialized successfully")
             
         except Exception as e:
-            logger.error(f"Failed to initialize components: {e}")
+            logger.error("Failed to initialize components: %s", e)
             sys.exit(1)
     
     def run_outreach_campaign(self, test_mode: bool = False, sheet_name: str = "outreach_leads"):
         """Run the main outreach campaign."""
-        logger.info(f"Starting outreach campaign (test_mode={test_mode})")
+        logger.info("Starting outreach campaign (test_mode=%s)", test_mode)
         
         try:
             # Get pending leads
-            pending_leads = self.sheets_manager.get_pending_leads(sheet_name)
+            pending_leads = self.sheets_manager.get_pending_leads_server(sheet_name)
             
             if not pending_leads:
                 logger.info("No pending leads found. Campaign complete.")
                 return
             
-            logger.info(f"Processing {len(pending_leads)} pending leads...")
+            logger.info("Processing %s pending leads...", len(pending_leads))
             
-            success_count = 0
-            error_count = 0
+            self._status_sheet = sheet_name
+            self._unwritten_statuses = []
             
+            # Skip repeated contacts so each person is only generated for and messaged once.
+            # Invalid contacts are never deduped so they still fail and get marked Error.
+            unique_leads = []
+            seen_contacts = set()
+            duplicate_count = 0
             for lead in pending_leads:
-                logger.info(f"Processing lead: {lead['name']} ({lead['contact']})")
+                if not self.sender.is_valid_contact(lead['contact']):
+                    unique_leads.append(lead)
+                    continue
+                contact_key = normalize_contact(lead['contact'])
+                if contact_key in seen_contacts:
+                    logger.info("Skipping duplicate contact: %s (%s)", lead['name'], lead['contact'])
+                    if not test_mode:
+                        self._record_status(lead['row_number'], "Duplicate")
+                    duplicate_count += 1
+                    continue
+                seen_contacts.add(contact_key)
+                unique_leads.append(lead)
+            
+            try:
+                results = asyncio.run(self._process_leads(unique_leads, test_mode))
+            finally:
+                self.sender.close()
+                # Persist remaining statuses, even if the run was interrupted
+                self._flush_statuses()
+            
+            if self._unwritten_statuses:
+                rows = ', '.join(f"{row_number} ({status})" for row_number, status in self._unwritten_statuses)
+                raise RuntimeError(
+                    f"Could not write lead statuses to the sheet; set these rows by hand: {rows}"
+                )
+            
+            success_count = sum(1 for ok in results if ok)
+            error_count = len(results) - success_count
+            
+            # Summary
+            logger.info("Campaign completed! Success: %s, Errors: %s, Duplicates: %s",
+                        success_count, error_count, duplicate_count)
+            
+        except Exception as e:
+            logger.error("Campaign failed with error: %s", e)
+            raise
+    
+    async def _process_leads(self, leads: List[Dict], test_mode: bool) -> List[bool]:
+        """Run leads through a generate -> send -> record pipeline.
+        
+        Each stage has its own workers connected by queues, so while one lead is being
+        sent the next is being generated and earlier statuses are being written.
+        """
+        lead_queue = asyncio.Queue()
+        for lead in leads:
+            lead_queue.put_nowait(lead)
+        # Bounded so generation only runs a little ahead of sending
+        send_queue = asyncio.Queue(maxsize=MAX_CONCURRENT_LEADS)
+        status_queue = asyncio.Queue()
+        results = []
+        # Shared across send workers so each provider stays under its rate however many workers run
+        send_limiters = {
+            'email': RateLimiter(SMTP_MESSAGES_PER_SECOND),
+            'whatsapp': RateLimiter(TWILIO_MESSAGES_PER_SECOND)
+        }
+        
+        workers = [
+            asyncio.create_task(self._generate_worker(lead_queue, send_queue, status_queue, test_mode, results))
+            for _ in range(GENERATE_WORKERS)
+        ]
+        workers += [
+            asyncio.create_task(self._send_worker(send_queue, status_queue, send_limiters, test_mode, results))
+            for _ in range(MAX_CONCURRENT_LEADS)
+        ]
+        workers.append(asyncio.create_task(self._record_worker(status_queue)))
+        
+        try:
+            await lead_queue.join()
+            await send_queue.join()
+            await status_queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        
+        return results
+    
+    async def _generate_worker(self, lead_queue: asyncio.Queue, send_queue: asyncio.Queue,
+                               status_queue: asyncio.Queue, test_mode: bool, results: List[bool]):
+        """Generate messages for queued leads and pass them on to the send stage."""
+        while True:
+            lead = await lead_queue.get()
+            try:
+                # Leave the lead Pending once statuses can no longer be recorded
+                if self._unwritten_statuses:
+                    continue
+                
+                logger.info("Processing lead: %s (%s)", lead['name'], lead['contact'])
                 
                 # Generate personalized message
-                message = self.message_generator.generate_message(lead)
-                if not message:
-                    logger.error(f"Failed to generate message for {lead['name']}")
+                message = await self.message_generator.generate_message_async(lead)
+                if message:
+                    await send_queue.put((lead, message))
+                else:
+                    logger.error("Failed to generate message for %s", lead['name'])
                     if not test_mode:
-                        self.sheets_manager.update_lead_status(lead['row_number'], "Error")
-                    error_count += 1
+                        status_queue.put_nowait((lead['row_number'], "Error"))
+                    results.append(False)
+            finally:
+                lead_queue.task_done()
+    
+    async def _send_worker(self, send_queue: asyncio.Queue, status_queue: asyncio.Queue,
+                           send_limiters: Dict[str, RateLimiter], test_mode: bool, results: List[bool]):
+        """Send generated messages and pass their statuses on to the record stage."""
+        while True:
+            lead, message = await send_queue.get()
+            try:
+                # Stop sending once statuses can no longer be recorded, so nobody is messaged twice
+                if self._unwritten_statuses:
                     continue
                 
-                # Send message
-                success, result_msg = self.sender.send_message(lead, message, test_mode)
+                limiter = send_limiters.get(self.sender.channel_for(lead['contact']))
+                if limiter and not test_mode:
+                    await limiter.acquire()
+                
+                # SMTP and Twilio clients are blocking, so run them off the event loop
+                success, result_msg = await asyncio.to_thread(
+                    self.sender.send_message, lead, message, test_mode
+                )
                 
                 if success:
-                    logger.info(f"SUCCESS: {result_msg}")
-                    if not test_mode:
-                        self.sheets_manager.update_lead_status(lead['row_number'], "Sent")
-                    success_count += 1
+                    logger.info("SUCCESS: %s", result_msg)
                 else:
-                    logger.error(f"ERROR: {result_msg}")
-                    if not test_mode:
-                        self.sheets_manager.update_lead_status(lead['row_number'], "Error")
-                    error_count += 1
+                    logger.error("ERROR: %s", result_msg)
+                if not test_mode:
+                    status_queue.put_nowait((lead['row_number'], "Sent" if success else "Error"))
+                results.append(success)
+            finally:
+                send_queue.task_done()
+    
+    async def _record_worker(self, status_queue: asyncio.Queue):
+        """Collect statuses and write them every STATUS_BATCH_SIZE updates or STATUS_FLUSH_SECONDS."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STATUS_FLUSH_SECONDS
+        try:
+            while True:
+                try:
+                    update = await asyncio.wait_for(status_queue.get(), timeout=max(0, deadline - loop.time()))
+                    self._status_updates.append(update)
+                    status_queue.task_done()
+                except asyncio.TimeoutError:
+                    pass
                 
-                # Add a small delay between messages to avoid rate limiting
-                import time
-                time.sleep(1)
-            
-            # Summary
-            logger.info(f"Campaign completed! Success: {success_count}, Errors: {error_count}")
-            
-        except Exception as e:
-            logger.error(f"Campaign failed with error: {e}")
+                if len(self._status_updates) >= STATUS_BATCH_SIZE or loop.time() >= deadline:
+                    if self._status_updates:
+                        batch, self._status_updates = self._status_updates, []
+                        # The Sheets client is blocking; this worker is its only user during the run
+                        await asyncio.to_thread(self._write_statuses, batch)
+                    deadline = loop.time() + STATUS_FLUSH_SECONDS
+        except asyncio.CancelledError:
+            # Keep anything still queued so the final flush writes it
+            while not status_queue.empty():
+                self._status_updates.append(status_queue.get_nowait())
+                status_queue.task_done()
             raise
     
+    def _record_status(self, row_number: int, status: str):
+        """Buffer a status update for the next sheet write."""
+        self._status_updates.append((row_number, status))
+    
+    def _flush_statuses(self):
+        """Write any buffered status updates to the sheet."""
+        batch, self._status_updates = self._status_updates, []
+        self._write_statuses(batch)
+    
+    def _write_statuses(self, batch: List):
+        """Write a batch of status updates, retrying once.
+        
+        A batch that still fails is kept in _unwritten_statuses, which stops further
+        generating and sending; run_outreach_campaign raises once the run has wound down.
+        """
+        if not batch:
+            return
+        try:
+            self.sheets_manager.batch_update_statuses(batch, self._status_sheet)
+            return
+        except Exception as e:
+            logger.warning("Failed to write lead statuses, retrying: %s", e)
+        
+        time.sleep(STATUS_RETRY_SECONDS)
+        try:
+            self.sheets_manager.batch_update_statuses(batch, self._status_sheet)
+        except Exception as e:
+            logger.error("Failed to write statuses for rows %s; stopping sends: %s",
+                         ', '.join(str(row_number) for row_number, _ in batch), e)
+            self._unwritten_statuses.extend(batch)
+    
     def test_connections(self):
         """Test all API connections."""
         logger.info("Testing API connections...")
-        
-        # Test Google Sheets
+        asyncio.run(self._run_connection_probes())
+    
+    async def _run_connection_probes(self):
+        """Run the independent connection probes concurrently."""
+        # The probes use blocking clients, so each runs in its own worker thread
+        await asyncio.gather(
+            asyncio.to_thread(self._probe_sheets),
+            asyncio.to_thread(self._probe_gemini),
+            asyncio.to_thread(self._probe_gmail),
+            asyncio.to_thread(self._probe_twilio),
+            return_exceptions=True
+        )
+    
+    def _probe_sheets(self):
+        """Test the Google Sheets connection."""
         try:
-            leads = self.sheets_manager.read_leads()
-            logger.info(f"SUCCESS: Google Sheets: Connected successfully ({len(leads)} leads found)")
+            leads = self.sheets_manager.read_leads(refresh=True)
+            logger.info("SUCCESS: Google Sheets: Connected successfully (%s leads found)", len(leads))
         except Exception as e:
-            logger.error(f"ERROR: Google Sheets: Connection failed - {e}")
-        
-        # Test Gemini API
+            logger.error("ERROR: Google Sheets: Connection failed - %s", e)
+    
+    def _probe_gemini(self):
+        """Test the Gemini API connection."""
         try:
             sample_lead = {
                 'name': 'Test User',
@@ -169,17 +385,18 @@ class OutreachAssistant:
             else:
                 logger.error("ERROR: Gemini API: Failed to generate test message")
         except Exception as e:
-            logger.error(f"ERROR: Gemini API: Connection failed - {e}")
-        
-        # Test email and WhatsApp connections
-        connection_results = self.sender.test_connection()
-        
-        if connection_results.get('gmail'):
+            logger.error("ERROR: Gemini API: Connection failed - %s", e)
+    
+    def _probe_gmail(self):
+        """Test the Gmail SMTP connection."""
+        if self.sender.test_gmail_connection():
             logger.info("SUCCESS: Gmail SMTP: Connected successfully")
         else:
             logger.error("ERROR: Gmail SMTP: Connection failed")
-        
-        if connection_results.get('twilio'):
+    
+    def _probe_twilio(self):
+        """Test the Twilio WhatsApp connection."""
+        if self.sender.test_twilio_connection():
             logger.info("SUCCESS: Twilio WhatsApp: Connected successfully")
         else:
             logger.error("ERROR: Twilio WhatsApp: Connection failed")
@@ -189,23 +406,26 @@ class OutreachAssistant:
         logger.info("Looking for failed leads to retry...")
         
         try:
-            all_leads = self.sheets_manager.read_leads(sheet_name)
-            failed_leads = [lead for lead in all_leads if lead['status'].lower() == 'error']
+            failed_leads = [
+                lead for lead in self.sheets_manager.iter_pending_or_error(sheet_name)
+                if lead['status'].lower() == 'error'
+            ]
             
             if not failed_leads:
                 logger.info("No failed leads found.")
                 return
             
-            logger.info(f"Found {len(failed_leads)} failed leads. Resetting to 'Pending'...")
+            logger.info("Found %s failed leads. Resetting to 'Pending'...", len(failed_leads))
             
+            status_updates = [(lead['row_number'], "Pending") for lead in failed_leads]
+            self.sheets_manager.batch_update_statuses(status_updates, sheet_name)
             for lead in failed_leads:
-                self.sheets_manager.update_lead_status(lead['row_number'], "Pending")
-                logger.info(f"Reset {lead['name']} to Pending status")
+                logger.info("Reset %s to Pending status", lead['name'])
             
-            logger.info(f"Successfully reset {len(failed_leads)} leads to 'Pending' status")
+            logger.info("Successfully reset %s leads to 'Pending' status", len(failed_leads))
             
         except Exception as e:
-            logger.error(f"Failed to retry leads: {e}")
+            logger.error("Failed to retry leads: %s", e)
             raise
 
 def main():
@@ -230,7 +450,7 @@ def main():
     except KeyboardInterrupt:
         logger.info("Campaign interrupted by user")
     except Exception as e:
-        logger.error(f"Application error: {e}")
+        logger.error("Application error: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":
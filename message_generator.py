@@ -1,14 +1,53 @@
 import os
+import json
+import asyncio
+import hashlib
 import logging
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
 from typing import Dict, Optional
 
+from rate_limiter import RateLimiter
+
 logger = logging.getLogger(__name__)
 
+# Generated templates are persisted here so reruns reuse them
+TEMPLATE_CACHE_DIR = os.path.join('.cache', 'gemini')
+
+# Placeholder Gemini is asked to use in place of the lead's name
+NAME_PLACEHOLDER = '{{NAME}}'
+
+# Gemini request rate (gemini-1.5-flash free tier allows 15 requests per minute)
+GEMINI_REQUESTS_PER_MINUTE = 15
+
+# Retries after a 429 (ResourceExhausted), backing off from this many seconds
+GEMINI_MAX_RETRIES = 3
+GEMINI_RETRY_BASE_SECONDS = 4
+
 class MessageGenerator:
-    def __init__(self, api_key: str):
+    # Filled with str.format_map; the doubled braces render as the literal NAME_PLACEHOLDER
+    _PROMPT_TMPL = """You are an outreach assistant. Generate a friendly, professional WhatsApp or email message for a lead.
+
+Lead Details:
+- Region: {region}
+- Interest: {interest}
+
+Requirements:
+1. Greet the lead by name, writing {{{{NAME}}}} exactly where their name goes.
+2. Mention their interest and region naturally.
+3. Keep it under 80 words.
+4. End with a clear call to action.
+
+Return ONLY the message."""
+    
+    def __init__(self, api_key: str, requests_per_minute: float = GEMINI_REQUESTS_PER_MINUTE):
         self.api_key = api_key
+        self._rate_limiter = RateLimiter(requests_per_minute / 60)
+        self._template_cache: Dict[str, str] = {}
+        self._pending_templates: Dict[str, asyncio.Future] = {}
+        self._cache_path = self._get_cache_path()
         self._configure_gemini()
+        self._load_template_cache()
     
     def _configure_gemini(self):
         """Configure Gemini API with the provided API key."""
@@ -17,51 +56,136 @@ class MessageGenerator:
             self.model = genai.GenerativeModel('gemini-1.5-flash')
             logger.info("Successfully configured Gemini API")
         except Exception as e:
-            logger.error(f"Failed to configure Gemini API: {e}")
+            logger.error("Failed to configure Gemini API: %s", e)
             raise
     
-    def generate_message(self, lead: Dict) -> Optional[str]:
-        """Generate a personalized outreach message for a lead using Gemini API."""
+    def generate_message(self, lead: Dict, use_cache: bool = True) -> Optional[str]:
+        """Generate a personalized outreach message for a lead using Gemini API.
+        
+        With use_cache=False the template cache is neither read nor written.
+        """
         try:
-            prompt = self._create_prompt(lead)
+            key = self._cache_key(lead)
+            template = self._template_cache.get(key) if use_cache else None
             
-            response = self.model.generate_content(prompt)
+            if template is None:
+                response = self.model.generate_content(self._create_prompt(lead))
+                template = self._extract_template(response, lead)
+                if template is None:
+                    return None
+                if use_cache:
+                    self._store_template(key, template)
             
-            if response.text:
-                message = response.text.strip()
-                logger.info(f"Generated message for {lead['name']}")
-                return message
-            else:
-                logger.error(f"Empty response from Gemini for {lead['name']}")
-                return None
-                
+            return self._render(template, lead)
+        
         except Exception as e:
-            logger.error(f"Error generating message for {lead['name']}: {e}")
+            logger.error("Error generating message for %s: %s", lead['name'], e)
             return None
     
-    def _create_prompt(self, lead: Dict) -> str:
-        """Create the prompt template for Gemini API."""
-        prompt = f"""You are an outreach assistant. Generate a friendly, professional WhatsApp or email message for a lead.
-
-Lead Details:
-- Name: {lead['name']}
-- Region: {lead['region']}
-- Interest: {lead['interest']}
-
-Requirements:
-1. Greet the lead by name.
-2. Mention their interest and region naturally.
-3. Keep it under 80 words.
-4. End with a clear call to action.
-
-Return ONLY the message."""
+    async def generate_message_async(self, lead: Dict) -> Optional[str]:
+        """Async variant of generate_message using Gemini's async client."""
+        try:
+            key = self._cache_key(lead)
+            template = self._template_cache.get(key)
+            
+            if template is None:
+                # Leads sharing a (region, interest) pair wait on a single request
+                pending = self._pending_templates.get(key)
+                if pending is None:
+                    pending = asyncio.ensure_future(self._fetch_template_async(key, lead))
+                    self._pending_templates[key] = pending
+                    pending.add_done_callback(lambda _: self._pending_templates.pop(key, None))
+                template = await pending
+                if template is None:
+                    return None
+            
+            return self._render(template, lead)
+        
+        except Exception as e:
+            logger.error("Error generating message for %s: %s", lead['name'], e)
+            return None
+    
+    async def _fetch_template_async(self, key: str, lead: Dict) -> Optional[str]:
+        """Request a new template from Gemini and cache it."""
+        prompt = self._create_prompt(lead)
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            await self._rate_limiter.acquire()
+            try:
+                response = await self.model.generate_content_async(prompt)
+                break
+            except ResourceExhausted:
+                if attempt == GEMINI_MAX_RETRIES:
+                    raise
+                delay = GEMINI_RETRY_BASE_SECONDS * 2 ** attempt
+                logger.warning("Gemini rate limit hit; retrying in %s seconds", delay)
+                await asyncio.sleep(delay)
+        
+        template = self._extract_template(response, lead)
+        if template is not None:
+            self._store_template(key, template)
+        return template
+    
+    def _extract_template(self, response, lead: Dict) -> Optional[str]:
+        """Pull the message template text out of a Gemini response."""
+        if response.text:
+            template = response.text.strip()
+            logger.info("Generated message template for %s / %s", lead['region'], lead['interest'])
+            return template
+        else:
+            logger.error("Empty response from Gemini for %s", lead['name'])
+            return None
+    
+    def _render(self, template: str, lead: Dict) -> str:
+        """Fill the lead's name into a cached template."""
+        message = template.replace(NAME_PLACEHOLDER, lead['name'])
+        logger.info("Generated message for %s", lead['name'])
+        return message
+    
+    def _cache_key(self, lead: Dict) -> str:
+        """Build the template cache key from the fields the prompt depends on."""
+        return json.dumps([lead['region'], lead['interest']])
+    
+    def _get_cache_path(self) -> str:
+        """Return the cache file for this API key, so keys never share templates."""
+        key_hash = hashlib.sha256(self.api_key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(TEMPLATE_CACHE_DIR, f"templates_{key_hash}.json")
+    
+    def _load_template_cache(self):
+        """Load previously generated templates from disk."""
+        try:
+            with open(self._cache_path, 'r', encoding='utf-8') as f:
+                self._template_cache = json.load(f)
+            logger.info("Loaded %s cached message templates", len(self._template_cache))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Ignoring unreadable template cache %s: %s", self._cache_path, e)
+    
+    def _store_template(self, key: str, template: str):
+        """Cache a template in memory and persist the cache to disk."""
+        if NAME_PLACEHOLDER not in template:
+            # Without the placeholder the message can't be personalised for other leads
+            logger.warning("Gemini response is missing the name placeholder; not caching it")
+            return
         
-        return prompt
+        self._template_cache[key] = template
+        try:
+            os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{self._cache_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._template_cache, f)
+            os.replace(tmp_path, self._cache_path)
+        except Exception as e:
+            logger.warning("Failed to persist template cache: %s", e)
+    
+    def _create_prompt(self, lead: Dict) -> str:
+        """Create the prompt for Gemini API from the pre-built template."""
+        return self._PROMPT_TMPL.format_map(lead)
     
     def test_generation(self, sample_lead: Dict) -> str:
         """Test message generation with a sample lead."""
         logger.info("Testing message generation...")
-        message = self.generate_message(sample_lead)
+        message = self.generate_message(sample_lead, use_cache=False)
         if message:
             logger.info("Test successful!")
             return message
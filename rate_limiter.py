@@ -0,0 +1,18 @@
+import asyncio
+
+class RateLimiter:
+    """Async limiter that spaces acquisitions so callers stay under a provider's rate."""
+    
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second
+        self._lock = asyncio.Lock()
+        self._next_time = 0.0
+    
+    async def acquire(self):
+        """Wait until the next request slot is free and claim it."""
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_time = max(loop.time(), self._next_time) + self.interval
\ No newline at end of file
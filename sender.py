@@ -2,27 +2,100 @@ import os
 import logging
 import smtplib
 import re
+import threading
+import httpx
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioException
 from typing import Dict, Tuple, Optional
 
 logger = logging.getLogger(__name__)
 
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_SSL_PORT = 465
+
+TWILIO_API_BASE = 'https://api.twilio.com/2010-04-01/Accounts'
+
+# Send rates per provider, used to throttle the campaign's send stage
+SMTP_MESSAGES_PER_SECOND = 1
+TWILIO_MESSAGES_PER_SECOND = 1
+
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\Z')
+# Common phone number punctuation, with and without the leading '+'. Whitespace
+# (including Unicode spaces like U+00A0) is removed separately with str.split().
+_PHONE_TRANS = str.maketrans('', '', '-()+')
+_PHONE_TRANS_NOPLUS = str.maketrans('', '', '-()')
+
+def normalize_contact(contact: str) -> str:
+    """Return the canonical form of a contact: a lowercased email or an E.164 phone number."""
+    contact = contact.strip()
+    if _EMAIL_RE.match(contact):
+        return contact.lower()
+    
+    # Clean the phone number
+    cleaned_phone = ''.join(contact.split()).translate(_PHONE_TRANS_NOPLUS)
+    if not cleaned_phone.lstrip('+').isdigit():
+        return contact.lower()
+    
+    if cleaned_phone.startswith('+'):
+        return cleaned_phone
+    # Indian numbers: if starts with 91 and is 12 digits, add +
+    if cleaned_phone.startswith('91') and len(cleaned_phone) == 12:
+        return '+' + cleaned_phone
+    # Indian numbers: if 10 digits and starts with 6,7,8,9 (Indian mobile prefixes)
+    elif len(cleaned_phone) == 10 and cleaned_phone[0] in ['6', '7', '8', '9']:
+        return '+91' + cleaned_phone
+    # US numbers: if 10 digits and starts with other digits
+    elif len(cleaned_phone) == 10:
+        return '+1' + cleaned_phone
+    # Otherwise, assume it needs + prefix
+    else:
+        return '+' + cleaned_phone
+
 class MessageSender:
     def __init__(self, gmail_user: str, gmail_password: str, 
-                 twilio_sid: str, twilio_token: str, twilio_whatsapp_number: str):
+                 twilio_sid: str, twilio_token: str, twilio_whatsapp_number: str,
+                 twilio_messaging_service_sid: Optional[str] = None):
         self.gmail_user = gmail_user
         self.gmail_password = gmail_password
-        self.twilio_client = Client(twilio_sid, twilio_token)
+        self._twilio_sid = twilio_sid
+        self._twilio_token = twilio_token
         self.twilio_whatsapp_number = twilio_whatsapp_number
+        self.twilio_messaging_service_sid = twilio_messaging_service_sid
+        self._smtp = None
+        # Sends may run from worker threads; smtplib connections are not thread-safe
+        self._smtp_lock = threading.Lock()
+        # Twilio clients are built lazily; the lock stops concurrent first sends building several
+        self._twilio_client = None
+        self._http_client = None
+        self._client_lock = threading.Lock()
         
+    @property
+    def twilio_client(self):
+        """Twilio REST client, imported and built on first use."""
+        with self._client_lock:
+            if self._twilio_client is None:
+                from twilio.rest import Client
+                self._twilio_client = Client(self._twilio_sid, self._twilio_token)
+            return self._twilio_client
+    
+    @property
+    def _http(self) -> httpx.Client:
+        """Long-lived keep-alive client so WhatsApp sends don't each pay a TLS handshake."""
+        with self._client_lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    http2=True,
+                    base_url=f"{TWILIO_API_BASE}/{self._twilio_sid}",
+                    auth=(self._twilio_sid, self._twilio_token),
+                    timeout=10
+                )
+            return self._http_client
+    
     def send_message(self, lead: Dict, message: str, test_mode: bool = False) -> Tuple[bool, str]:
         """Send message via email or WhatsApp based on contact format."""
         if test_mode:
-            logger.info(f"TEST MODE: Would send to {lead['name']} ({lead['contact']})")
-            logger.info(f"Message: {message}")
+            logger.info("TEST MODE: Would send to %s (%s)", lead['name'], lead['contact'])
+            logger.info("Message: %s", message)
             return True, "Test mode - message not actually sent"
         
         contact = lead['contact'].strip()
@@ -37,15 +110,27 @@ class MessageSender:
             logger.error(error_msg)
             return False, error_msg
     
+    def is_valid_contact(self, contact: str) -> bool:
+        """Check if contact is an email address or phone number send_message can deliver to."""
+        return self.channel_for(contact) is not None
+    
+    def channel_for(self, contact: str) -> Optional[str]:
+        """Return 'email' or 'whatsapp' for the provider send_message would use, or None."""
+        contact = contact.strip()
+        if self._is_email(contact):
+            return 'email'
+        elif self._is_phone_number(contact):
+            return 'whatsapp'
+        return None
+    
     def _is_email(self, contact: str) -> bool:
         """Check if contact is a valid email address."""
-        email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(email_pattern, contact) is not None
+        return _EMAIL_RE.match(contact) is not None
     
     def _is_phone_number(self, contact: str) -> bool:
         """Check if contact is a valid phone number (basic check)."""
         # Remove common phone number characters
-        cleaned = re.sub(r'[\s\-\(\)\+]', '', contact)
+        cleaned = ''.join(contact.split()).translate(_PHONE_TRANS)
         # Check if it's all digits and reasonable length
         return cleaned.isdigit() and 10 <= len(cleaned) <= 15
     
@@ -60,15 +145,20 @@ class MessageSender:
             
             msg.attach(MIMEText(message, 'plain'))
             
-            # Connect to Gmail SMTP server
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-            server.starttls()
-            server.login(self.gmail_user, self.gmail_password)
-            
-            # Send email
+            # Send email over the shared connection, reconnecting once if it dropped
             text = msg.as_string()
-            server.sendmail(self.gmail_user, email, text)
-            server.quit()
+            with self._smtp_lock:
+                try:
+                    self._get_smtp().sendmail(self.gmail_user, email, text)
+                except smtplib.SMTPServerDisconnected:
+                    self._reset_smtp()
+                    self._get_smtp().sendmail(self.gmail_user, email, text)
+                except smtplib.SMTPResponseException as e:
+                    # 421: the server is closing the connection; other codes are per-message failures
+                    if e.smtp_code != 421:
+                        raise
+                    self._reset_smtp()
+                    self._get_smtp().sendmail(self.gmail_user, email, text)
             
             success_msg = f"Email sent successfully to {lead['name']} ({email})"
             logger.info(success_msg)
@@ -79,42 +169,68 @@ class MessageSender:
             logger.error(error_msg)
             return False, error_msg
     
+    def _get_smtp(self) -> smtplib.SMTP:
+        """Return the authenticated Gmail SMTP connection, opening it on first use."""
+        if self._smtp is None:
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_SSL_PORT)
+            try:
+                server.login(self.gmail_user, self.gmail_password)
+            except Exception:
+                server.close()
+                raise
+            self._smtp = server
+        return self._smtp
+    
+    def _reset_smtp(self):
+        """Drop the current SMTP connection so the next send reconnects."""
+        server, self._smtp = self._smtp, None
+        if server is not None:
+            try:
+                server.close()
+            except Exception:
+                pass
+    
+    def close(self):
+        """Close the shared SMTP and Twilio HTTP connections."""
+        # Only close the HTTP client if a WhatsApp send actually created it
+        with self._client_lock:
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+        with self._smtp_lock:
+            if self._smtp is None:
+                return
+            try:
+                self._smtp.quit()
+            except Exception as e:
+                logger.warning("Error closing SMTP connection: %s", e)
+            finally:
+                self._smtp = None
+    
     def _send_whatsapp(self, lead: Dict, message: str, phone: str) -> Tuple[bool, str]:
         """Send message via Twilio WhatsApp API."""
         try:
             # Format phone number for WhatsApp
-            if not phone.startswith('+'):
-                # Clean the phone number
-                cleaned_phone = re.sub(r'[\s\-\(\)]', '', phone)
-                
-                # Indian numbers: if starts with 91 and is 12 digits, add +
-                if cleaned_phone.startswith('91') and len(cleaned_phone) == 12:
-                    phone = '+' + cleaned_phone
-                # Indian numbers: if 10 digits and starts with 6,7,8,9 (Indian mobile prefixes)
-                elif len(cleaned_phone) == 10 and cleaned_phone[0] in ['6', '7', '8', '9']:
-                    phone = '+91' + cleaned_phone
-                # US numbers: if 10 digits and starts with other digits
-                elif len(cleaned_phone) == 10:
-                    phone = '+1' + cleaned_phone
-                # Otherwise, assume it needs + prefix
-                else:
-                    phone = '+' + cleaned_phone
+            phone = normalize_contact(phone)
             
             whatsapp_to = f"whatsapp:{phone}"
             
-            # Send WhatsApp message
-            message_obj = self.twilio_client.messages.create(
-                body=message,
-                from_=self.twilio_whatsapp_number,
-                to=whatsapp_to
-            )
+            # Send WhatsApp message, letting a Messaging Service pick the sender when configured
+            data = {'To': whatsapp_to, 'Body': message}
+            if self.twilio_messaging_service_sid:
+                data['MessagingServiceSid'] = self.twilio_messaging_service_sid
+            else:
+                data['From'] = self.twilio_whatsapp_number
+            
+            response = self._http.post('/Messages.json', data=data)
+            response.raise_for_status()
             
             success_msg = f"WhatsApp sent successfully to {lead['name']} ({phone})"
             logger.info(success_msg)
             return True, success_msg
             
-        except TwilioException as e:
-            error_msg = f"Failed to send WhatsApp to {lead['name']} ({phone}): {e}"
+        except httpx.HTTPStatusError as e:
+            error_msg = f"Failed to send WhatsApp to {lead['name']} ({phone}): {e.response.status_code} {e.response.text}"
             logger.error(error_msg)
             return False, error_msg
         except Exception as e:
@@ -124,28 +240,34 @@ class MessageSender:
     
     def test_connection(self) -> Dict[str, bool]:
         """Test both email and WhatsApp connections."""
-        results = {}
-        
-        # Test Gmail connection
+        return {
+            'gmail': self.test_gmail_connection(),
+            'twilio': self.test_twilio_connection()
+        }
+    
+    def test_gmail_connection(self) -> bool:
+        """Test the Gmail SMTP login."""
         try:
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-            server.starttls()
-            server.login(self.gmail_user, self.gmail_password)
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_SSL_PORT)
+            try:
+                server.login(self.gmail_user, self.gmail_password)
+            except Exception:
+                server.close()
+                raise
             server.quit()
-            results['gmail'] = True
             logger.info("Gmail connection test successful")
+            return True
         except Exception as e:
-            results['gmail'] = False
-            logger.error(f"Gmail connection test failed: {e}")
-        
-        # Test Twilio connection
+            logger.error("Gmail connection test failed: %s", e)
+            return False
+    
+    def test_twilio_connection(self) -> bool:
+        """Test the Twilio credentials."""
         try:
             # Try to fetch account info to test connection
             account = self.twilio_client.api.accounts(self.twilio_client.account_sid).fetch()
-            results['twilio'] = True
             logger.info("Twilio connection test successful")
+            return True
         except Exception as e:
-            results['twilio'] = False
-            logger.error(f"Twilio connection test failed: {e}")
-        
-        return results
\ No newline at end of file
+            logger.error("Twilio connection test failed: %s", e)
+            return False
\ No newline at end of file